@@ -13,7 +13,7 @@ LP_LOG = LOG_DIR / Path('gurobi.log')
 LP_RELAXED_LOG = LOG_DIR / Path('gurobi_relaxed.log')
 P2P_LOG = LOG_DIR / Path('gurobi_p2p.log')
 INP_FILE = SRC_DIR / Path('inp-params.txt')
-SOLUTION_FILE = SRC_DIR / Path('solution.txt')
+SOLUTION_FILE = SRC_DIR / Path('solution.sol')
 OUT_LPGAP_FILE = LPGAP_DIR / Path('out.csv')
 OUT_RUNTIME_FILE = RUNTIME_DIR / Path('out.csv')
 OUT_P2PGAP_FILE = P2PGAP_DIR / Path('out.csv')
@@ -23,4 +23,13 @@ PLT_RUNTIME_FILE = RUNTIME_DIR / Path('plot.py')
 PLT_P2PGAP_FILE = P2PGAP_DIR / Path('plot.py')
 
 # Parameters
-RUNS = 5
\ No newline at end of file
+RUNS = 5
+K_PATHS = 50
+# Name constraints in Gurobi models, useful for debugging written models
+NAME_CONSTRAINTS = False
+
+# Gurobi parameters
+# Integral models: barrier root, aggressive presolve and cuts, and focus on finding feasible solutions
+MIP_PARAMS = {"Method": 2, "Presolve": 2, "Cuts": 2, "MIPFocus": 1, "Heuristics": 0.2}
+# Relaxed models: dual simplex
+LP_PARAMS = {"Method": 1}
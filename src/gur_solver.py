@@ -1,18 +1,79 @@
 # Define and solve flow problem on a quantum hierarchical network using gurobi
 
+import os
+import re
 import sys
+import multiprocessing
+import multiprocessing.pool
+from pathlib import Path
 from copy import deepcopy
 import itertools
+import functools
+import numpy as np
+import scipy.sparse as sp
 import gurobipy as gp
 from gurobipy import GRB
 import networkx as nx
-from utils.gen_graph import generate_random_hqnw, Params
+from utils.gen_graph import generate_random_hqnw, Params, GraphKey
 from utils.demand import generate_demand, Demand
-import gurobi_logtools as glt
+from utils.topology import Topology, build_topology, incidence_matrices
 from constants import *
+
+# Gurobi environment shared by every model of this process, see `gurobi_env`
+ENV: gp.Env | None = None
+
+def gurobi_env() -> gp.Env:
+    """
+    Get the Gurobi environment of this process, starting it on first use.
+
+    Starting an environment checks the license, so it is done once per process instead of once per model. Pool
+    workers are spawned with `run_pool`, so each one starts its own instead of inheriting the parent's.
+    """
+    global ENV
+    if ENV is None:
+        ENV = gp.Env()
+    return ENV
+
+def run_pool() -> multiprocessing.pool.Pool:
+    """
+    Get a pool of RUNS workers, spawned rather than forked so that no worker holds state of this process, such as
+    a started Gurobi environment.
+    """
+    return multiprocessing.get_context("spawn").Pool(RUNS)
+
+def pool_starmap(pool: multiprocessing.pool.Pool | None, func, args: list[tuple]) -> list:
+    """
+    Apply `func` to every tuple of `args` in `pool`, or in a pool started for this call only if it is None.
+
+    Sweeps should pass one pool for all of their configurations, so that workers keep their imports and Gurobi
+    environments instead of starting them again for every configuration.
+    """
+    if pool is not None:
+        return pool.starmap(func, args)
+    with run_pool() as pool:
+        return pool.starmap(func, args)
+
+def constr_name(fmt: str, *args) -> dict:
+    """
+    Get the keyword arguments naming a constraint, which are empty unless NAME_CONSTRAINTS is set.
+
+    The name is only formatted when it is used, so unnamed builds skip the string work entirely.
+    """
+    return {"name": fmt.format(*args)} if NAME_CONSTRAINTS else {}
+
+def sink_selector(edge_idx: list[np.ndarray], num_edges: int) -> sp.csr_matrix:
+    """
+    Build the matrix whose i-th row sums the flows of demand i on the edges `edge_idx[i]`.
+
+    Columns index the flattened (demand, edge) flow vector, so the matrix applies to `flow_vars.reshape(-1)`.
+    """
+    cols = np.concatenate([i * num_edges + idx for i, idx in enumerate(edge_idx)]).astype(np.int32)
+    indptr = np.concatenate([[0], np.cumsum([len(idx) for idx in edge_idx])]).astype(np.int32)
+    return sp.csr_matrix((np.ones(len(cols), dtype=np.int8), cols, indptr), shape=(len(edge_idx), len(edge_idx) * num_edges))
+
 # Define Problem class
 
-def edge_formulation(G: nx.DiGraph, demands: list[Demand], relaxed: bool = False, logf=None):
+def edge_formulation(G: nx.DiGraph, demands: list[Demand], relaxed: bool = False, logf=None, env: gp.Env | None = None, topo: Topology | None = None, relax_deltas: bool = False):
     """
     Define the flow problem on a quantum hierarchical network.
 
@@ -24,103 +85,220 @@ def edge_formulation(G: nx.DiGraph, demands: list[Demand], relaxed: bool = False
             distance threshold for each demand.
         relaxed (bool, default=False):
             Flag for whether the flow problem should be relaxed or not.
+        logf (Path, optional):
+            Log file of the model.
+        env (gp.Env, optional):
+            Gurobi environment to create the model in, defaults to `gurobi_env()`.
+        topo (Topology, optional):
+            Lookups of `G`, built if not given.
+        relax_deltas (bool, default=False):
+            Flag for whether the deltas of the integral model are continuous in [0, 1]. Faster, but a fractional
+            delta lets a flow use a path longer than the threshold, so the objective is only an upper bound.
 
     Returns:
         A tuple containing variables and the defined problem.
     """
     # Create a new model
-    logf = LP_LOG if not relaxed else LP_RELAXED_LOG
-    model = gp.Model("QuantumFlowProblem", env=gp.Env(str(logf.absolute())))
+    if logf is None:
+        logf = LP_LOG if not relaxed else LP_RELAXED_LOG
+    model = gp.Model("QuantumFlowProblem", env=env if env is not None else gurobi_env())
+    model.Params.LogFile = str(logf.absolute())
+
+    # Edge and node lookups
+    if topo is None:
+        topo = build_topology(G)
+    # Edge capacities
+    caps = topo.caps
+
+    # Demand pruning
+    # With binary deltas potentials grow by at least one per used edge, so a client more than `thres` hops away
+    # from the generator can never be served. Such demands are fixed to zero in the integral model only: with
+    # continuous deltas potentials grow by flow / capacity, so the relaxation can still serve them.
+    unreachable = []
+    if not relaxed:
+        hops = nx.single_source_shortest_path_length(G, "generator", cutoff=max((thres for *_, thres in demands), default=0))
+        hops = {topo.node_indices[node]: dist for node, dist in hops.items()}
+        unreachable = [i for i, (src, dst, _, thres) in enumerate(demands)
+                       if hops.get(topo.client_indices[src], np.inf) > thres or hops.get(topo.client_indices[dst], np.inf) > thres]
+    # Upper bound of every (demand, edge) variable, zero for pruned demands
+    demand_ub = np.ones(len(demands))
+    demand_ub[unreachable] = 0
+    edge_ub = np.full((len(demands), len(G.edges())), GRB.INFINITY)
+    edge_ub[unreachable] = 0
+
+    # Potential bounds
+    # Single-variable rows are set as bounds instead of constraints, given when the potentials are added
+    pot_ub = np.full((len(demands), len(G.nodes())), GRB.INFINITY)
+    demand_range = np.arange(len(demands))
+    thres = np.array([thres for *_, thres in demands], dtype=np.float64)
+    # If the node is src or dst, set potential <= threshold
+    pot_ub[demand_range, [topo.client_indices[src] for src, *_ in demands]] = thres
+    pot_ub[demand_range, [topo.client_indices[dst] for _, dst, *_ in demands]] = thres
+    # If the node is a generator, set potential to 0
+    gen_nodes = [topo.node_indices[node] for node in G.nodes() if G.nodes[node]['type'] == 'generator']
+    pot_ub[:, gen_nodes] = 0
 
     # Variables
+    # All bounds are passed on creation, so no attribute is written to a pending variable
     # Indicator variables for each demand (chi)
-    demand_vars = model.addVars(len(demands), vtype= GRB.BINARY if not relaxed else GRB.CONTINUOUS , name="demand_vars", ub=1)
+    demand_vars = model.addMVar(len(demands), vtype= GRB.BINARY if not relaxed else GRB.CONTINUOUS , name="demand_vars", ub=demand_ub)
 
     # Flow variables for each demand and each edge (f)
-    flow_vars = model.addVars(len(demands), len(G.edges()), vtype=GRB.INTEGER if not relaxed else GRB.CONTINUOUS, name="flow_vars", lb=0)
+    # Continuous even in the integral model: with chi and delta fixed the flows are usually integral already,
+    # and `ensure_integral_flows` re-solves with integer flows when they are not
+    flow_vars = model.addMVar((len(demands), len(G.edges())), vtype=GRB.CONTINUOUS, name="flow_vars", lb=0, ub=edge_ub)
 
     # Potential variables for every demand and node (p)
-    potentials = model.addVars(len(demands), len(G.nodes()), vtype=GRB.CONTINUOUS, name="potentials")
+    potentials = model.addMVar((len(demands), len(G.nodes())), vtype=GRB.CONTINUOUS, name="potentials", ub=pot_ub)
 
     # Delta variables for each demand and each edge (delta)
-    edge_deltas = model.addVars(len(demands), len(G.edges()), vtype=GRB.BINARY if not relaxed else GRB.CONTINUOUS, name="edge_deltas", ub=1)
+    edge_deltas = model.addMVar((len(demands), len(G.edges())), vtype=GRB.BINARY if not (relaxed or relax_deltas) else GRB.CONTINUOUS, name="edge_deltas", ub=np.minimum(edge_ub, 1))
+
+    # Pruned variables with their bounds without pruning, restored by `relax_flow_problem`
+    if unreachable:
+        model._unpruned_ub = [(demand_vars[unreachable], 1), (flow_vars[unreachable], GRB.INFINITY), (edge_deltas[unreachable], 1)]
 
     # Objective function
     # Maximize the number of demands satisfied
-    model.setObjective(gp.quicksum(demand_vars[i] for i in range(len(demands))), GRB.MAXIMIZE)
+    model.setObjective(demand_vars.sum(), GRB.MAXIMIZE)
 
-    # Mapping edges to indices
-    edge_indices = {edge: i for i, edge in enumerate(G.edges())}
-    # Mapping nodes to indices
-    node_indices = {node: i for i, node in enumerate(G.nodes())}
+    # Without demands every constraint is empty, and gurobipy rejects some of the empty matrix expressions
+    if not demands:
+        return model, demand_vars, flow_vars, potentials, edge_deltas
 
     # Constraints
     # Superimposed flow on each edge
-    for i, edge in enumerate(G.edges()):
-        # SUM_OVER_DEMANDS[f_d,e] <= capacity_e
-        # This is a change from the original code
-        # Basically, we set flow into a client to be zero if `chi_d` is 0, so that propagates across the graph to make
-        # the flow zero everywhere.
-        model.addConstr(gp.quicksum(flow_vars[j, i] for j in range(len(demands))) <= G.edges[edge]['capacity'], name=f"superimposed_flow_{i}")
+    # SUM_OVER_DEMANDS[f_d,e] <= capacity_e
+    # This is a change from the original code
+    # Basically, we set flow into a client to be zero if `chi_d` is 0, so that propagates across the graph to make
+    # the flow zero everywhere.
+    model.addConstr(flow_vars.sum(axis=0) <= caps, **constr_name("superimposed_flow"))
 
     # Flow conservation constraints
-    for i, node in enumerate(G.nodes()):
-        # Check if node is not a repeater
-        # Generator has no constraints and clients are sinks. 
-        if G.nodes[node]['type'] != 'repeater':
-            continue
-        for j, _ in enumerate(demands):
-            # Flow conservation: incoming flow = outgoing flow
-            model.addConstr(
-                gp.quicksum(flow_vars[j, edge_indices[edge]] for edge in G.in_edges(node)) -
-                gp.quicksum(flow_vars[j, edge_indices[edge]] for edge in G.out_edges(node)) == 0,
-                name=f"flow_conservation_{i}_{j}"
-            )
+    # Generator has no constraints and clients are sinks, so only repeaters get a row.
+    A_in, A_out = incidence_matrices(G, topo)
+    # Column e of `A` is +1 at the head and -1 at the tail of edge e
+    A = A_in - A_out
+    repeaters = [topo.node_indices[node] for node in G.nodes() if G.nodes[node]['type'] == 'repeater']
+    # Row r of `B` is (incoming - outgoing) edges of the r-th repeater
+    B = A[repeaters]
+    # One block of rows per demand over the flattened (demand, edge) flow vector
+    A_conserv = sp.kron(sp.identity(len(demands), dtype=np.int8), B, format="csr")
+    # Flow conservation: incoming flow = outgoing flow
+    model.addMConstr(A_conserv, flow_vars.reshape(-1), '=', np.zeros(A_conserv.shape[0], dtype=np.int8), **constr_name("flow_conservation"))
 
     # Capacity constraints
-    for i, edge in enumerate(G.edges()):
-        for j, _ in enumerate(demands):
-            # Flow on edge is less than capacity
-            model.addConstr(flow_vars[j, i] <= edge_deltas[j, i] * G.edges[edge]['capacity'], name=f"flow_capacity_{i}_{j}")
+    # Flow on edge is less than capacity, and only if the edge is used by the demand
+    # Row (d, e) of `C` is the capacity of edge e at delta[d, e] of the flattened (demand, edge) deltas
+    C = sp.kron(sp.identity(len(demands), dtype=np.int8), sp.diags(caps), format="csr")
+    model.addConstr(flow_vars.reshape(-1) - C @ edge_deltas.reshape(-1) <= 0, **constr_name("flow_capacity"))
 
     # Sink constraints
-    for i, (src, dst, qubits, _) in enumerate(demands):
-        # Flow conservation at src
-        # This is a change from the original code
-        # Refer to capacity constraint. Flow is zero if `chi_d` is 0.
-        # This makes the program linear, which is a good improvement over bilinear.
-        # Even for ILP, this is faster than the path stuff.
-        model.addConstr(
-            gp.quicksum(flow_vars[i, edge_indices[edge]] for edge in G.in_edges(f"client_{src}")) == qubits * demand_vars[i],
-            name=f"flow_conservation_src_{i}"
-        )
-        # Flow conservation at dst
-        model.addConstr(
-            gp.quicksum(flow_vars[i, edge_indices[edge]] for edge in G.in_edges(f"client_{dst}")) == qubits * demand_vars[i],
-            name=f"flow_conservation_dst_{i}"
-        )
+    # This is a change from the original code
+    # Refer to capacity constraint. Flow is zero if `chi_d` is 0.
+    # This makes the program linear, which is a good improvement over bilinear.
+    # Even for ILP, this is faster than the path stuff.
+    qubits = np.array([q for _, _, q, _ in demands], dtype=np.int32)
+    # Flow conservation at src
+    S_src = sink_selector([topo.client_in_idx[src] for src, *_ in demands], len(G.edges()))
+    model.addConstr(S_src @ flow_vars.reshape(-1) == qubits * demand_vars, **constr_name("flow_conservation_src"))
+    # Flow conservation at dst
+    S_dst = sink_selector([topo.client_in_idx[dst] for _, dst, *_ in demands], len(G.edges()))
+    model.addConstr(S_dst @ flow_vars.reshape(-1) == qubits * demand_vars, **constr_name("flow_conservation_dst"))
+
+    # Potential difference constraints
+    # p_v - p_u >= delta, for every demand and edge (u, v)
+    # Row (d, e) of `A_pot` is column e of `A` over the flattened (demand, node) potentials of demand d
+    A_pot = sp.kron(sp.identity(len(demands), dtype=np.int8), A.T, format="csr")
+    model.addConstr(A_pot @ potentials.reshape(-1) - edge_deltas.reshape(-1) >= 0, **constr_name("potential_difference"))
+
+    # Greedy incumbent, so branch-and-bound starts with a lower bound on the objective
+    if not relaxed:
+        chi, flows, deltas, pots = greedy_assign(G, demands, topo)
+        demand_vars.Start = chi
+        flow_vars.Start = flows
+        edge_deltas.Start = deltas
+        potentials.Start = pots
 
-    # Potential constraints
-    for i, (src, dst, _, thres) in enumerate(demands):
-        for j, node in enumerate(G.nodes()):
-            # If the node is a generator, set potential to 0
-            if G.nodes[node]['type'] == 'generator':
-                model.addConstr(potentials[i, j] == 0, name=f"potential_generator_{i}_{j}")
+    # Return the model and variables
+    return model, demand_vars, flow_vars, potentials, edge_deltas
 
-            # If the node is src or dst, set potential <= threshold
-            elif node == f"client_{src}" or node == f"client_{dst}":
-                model.addConstr(potentials[i, j] <= thres, name=f"potential_client_{i}_{j}")
 
-        for k, edge in enumerate(G.edges()):
-            # Potential difference constraints
-            # p_v - p_u >= delta
-            model.addConstr(potentials[i, node_indices[edge[1]]] - potentials[i, node_indices[edge[0]]] >= edge_deltas[i, k], name=f"potential_difference_{i}_{k}")
+def greedy_assign(G: nx.DiGraph, demands: list[Demand], topo: Topology | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Greedily serve demands, largest qubit demand first, along shortest paths from the generator to both clients.
 
-    # Return the model and variables
-    return model, demand_vars, flow_vars, potentials, edge_deltas
+    Every edge forces p_v >= p_u, so a used edge inside a cycle can never get delta = 1. Paths therefore only use
+    edges between strongly connected components, with enough residual capacity, and never pass through other
+    clients. A demand is accepted if both paths exist and the resulting potentials keep its clients within threshold.
 
+    Parameters:
+        G (nx.DiGraph): 
+            Directed graph representing the quantum network.
+        demands (List[Demand]): 
+            Demands to serve.
+        topo (Topology, optional):
+            Lookups of `G`, built if not given.
 
-def p2p_formulation(G: nx.DiGraph, demands: list[Demand], relaxed: bool = False, logf=None):
+    Returns:
+        Arrays chi (D,), flows (D, E), deltas (D, E) and potentials (D, V) of a feasible solution of `edge_formulation`.
+    """
+    if topo is None:
+        topo = build_topology(G)
+    nodes = list(G.nodes())
+    chi = np.zeros(len(demands))
+    flows = np.zeros((len(demands), len(topo.edges)))
+    deltas = np.zeros((len(demands), len(topo.edges)))
+    potentials = np.zeros((len(demands), len(nodes)))
+    residual = topo.caps.astype(np.float64)
+
+    # Potentials are equal within a component, so they are computed on the condensation
+    C = nx.condensation(G)
+    scc = np.array([C.graph['mapping'][node] for node in nodes], dtype=np.int32)
+    rank = {c: r for r, c in enumerate(nx.topological_sort(C))}
+    tails = np.array([topo.node_indices[u] for u, _ in topo.edges], dtype=np.int32)
+    heads = np.array([topo.node_indices[v] for _, v in topo.edges], dtype=np.int32)
+    cross = scc[tails] != scc[heads]
+    # Cross edges in topological order of their tails, so every component is final before it is propagated
+    cross_order = sorted(np.flatnonzero(cross), key=lambda e: rank[scc[tails[e]]])
+    clients = {node for node in nodes if G.nodes[node]['type'] == 'client'}
+    generator = topo.node_indices["generator"]
+
+    for i in sorted(range(len(demands)), key=lambda i: -demands[i][2]):
+        src, dst, qubits, thres = demands[i]
+        used = np.zeros(len(topo.edges))
+        for client in (src, dst):
+            target = nodes[topo.client_indices[client]]
+            usable = cross & (residual - used >= qubits)
+            view = nx.subgraph_view(
+                G,
+                filter_node=lambda node: node not in clients or node == target,
+                filter_edge=lambda u, v: usable[topo.edge_indices[(u, v)]]
+            )
+            try:
+                path = nx.shortest_path(view, nodes[generator], target)
+            except (nx.NetworkXNoPath, nx.NodeNotFound):
+                break
+            used[[topo.edge_indices[edge] for edge in zip(path, path[1:])]] += qubits
+        else:
+            # Longest path over the condensation, where used edges weigh 1
+            delta = (used > 0).astype(np.float64)
+            scc_pot = np.zeros(len(C))
+            for e in cross_order:
+                scc_pot[scc[heads[e]]] = max(scc_pot[scc[heads[e]]], scc_pot[scc[tails[e]]] + delta[e])
+            pot = scc_pot[scc]
+            if pot[generator] > 0 or pot[topo.client_indices[src]] > thres or pot[topo.client_indices[dst]] > thres:
+                continue
+            chi[i] = 1
+            flows[i] = used
+            deltas[i] = delta
+            potentials[i] = pot
+            residual -= used
+
+    return chi, flows, deltas, potentials
+
+
+def p2p_formulation(G: nx.DiGraph, demands: list[Demand], relaxed: bool = False, logf=None, env: gp.Env | None = None, topo: Topology | None = None):
     """
     Define the flow problem on a quantum hierarchical network.
 
@@ -132,6 +310,12 @@ def p2p_formulation(G: nx.DiGraph, demands: list[Demand], relaxed: bool = False,
             distance threshold for each demand.
         relaxed (bool, default=False):
             Flag for whether the flow problem should be relaxed or not.
+        logf (Path, optional):
+            Log file of the model.
+        env (gp.Env, optional):
+            Gurobi environment to create the model in, defaults to `gurobi_env()`.
+        topo (Topology, optional):
+            Lookups of `G`, built if not given.
 
     Returns:
         A tuple containing variables and the defined problem.
@@ -139,85 +323,85 @@ def p2p_formulation(G: nx.DiGraph, demands: list[Demand], relaxed: bool = False,
     # Create a new model
     if logf is None:
         logf = P2P_LOG if not relaxed else LP_RELAXED_LOG
-        
-    model = gp.Model("QuantumFlowProblem", env=gp.Env(str(logf.absolute())))
+
+    model = gp.Model("QuantumFlowProblem", env=env if env is not None else gurobi_env())
+    model.Params.LogFile = str(logf.absolute())
+
+    # Edge and node lookups
+    if topo is None:
+        topo = build_topology(G)
+    # Edge capacities
+    caps = topo.caps
+
+    # Potential bounds
+    # Single-variable rows are set as bounds instead of constraints, given when the potentials are added
+    # src is the source of its demand's potentials, and dst must be within the threshold of it
+    pot_ub = np.full((len(demands), len(G.nodes())), GRB.INFINITY)
+    demand_range = np.arange(len(demands))
+    pot_ub[demand_range, [topo.client_indices[src] for src, *_ in demands]] = 0
+    pot_ub[demand_range, [topo.client_indices[dst] for _, dst, *_ in demands]] = [thres for *_, thres in demands]
 
     # Variables
     # Indicator variables for each demand (chi)
-    demand_vars = model.addVars(len(demands), vtype= GRB.BINARY if not relaxed else GRB.CONTINUOUS , name="demand_vars", ub=1, lb=0)
+    demand_vars = model.addMVar(len(demands), vtype= GRB.BINARY if not relaxed else GRB.CONTINUOUS , name="demand_vars", ub=1, lb=0)
 
     # Flow variables for each demand and each edge (f)
-    flow_vars = model.addVars(len(demands), len(G.edges()), vtype=GRB.INTEGER if not relaxed else GRB.CONTINUOUS, name="flow_vars", lb=0)
+    flow_vars = model.addMVar((len(demands), len(G.edges())), vtype=GRB.INTEGER if not relaxed else GRB.CONTINUOUS, name="flow_vars", lb=0)
 
     # Potential variables for every demand and node (p)
-    potentials = model.addVars(len(demands), len(G.nodes()), vtype=GRB.CONTINUOUS, name="potentials")
+    potentials = model.addMVar((len(demands), len(G.nodes())), vtype=GRB.CONTINUOUS, name="potentials", ub=pot_ub)
 
     # Delta variables for each demand and each edge (delta)
-    edge_deltas = model.addVars(len(demands), len(G.edges()), vtype=GRB.BINARY if not relaxed else GRB.CONTINUOUS, name="edge_deltas", ub=1, lb=0)
+    edge_deltas = model.addMVar((len(demands), len(G.edges())), vtype=GRB.BINARY if not relaxed else GRB.CONTINUOUS, name="edge_deltas", ub=1, lb=0)
 
     # Objective function
     # Maximize the number of demands satisfied
-    model.setObjective(gp.quicksum(demand_vars[i] for i in range(len(demands))), GRB.MAXIMIZE)
-
-    # Mapping edges to indices
-    edge_indices = {edge: i for i, edge in enumerate(G.edges())}
-    # Mapping nodes to indices
-    node_indices = {node: i for i, node in enumerate(G.nodes())}
+    model.setObjective(demand_vars.sum(), GRB.MAXIMIZE)
 
     # Constraints
     # Superimposed flow on each edge
-    for i, edge in enumerate(G.edges()):
-        # SUM_OVER_DEMANDS[f_d,e] <= capacity_e
-        # This is a change from the original code
-        # Basically, we set flow into a client to be zero if `chi_d` is 0, so that propagates across the graph to make
-        # the flow zero everywhere.
-        model.addConstr(gp.quicksum(flow_vars[j, i] for j in range(len(demands))) <= G.edges[edge]['capacity'], name=f"superimposed_flow_{i}")
-        for j, _ in enumerate(demands):
-            # Flow on edge is less than capacity
-            model.addConstr(flow_vars[j, i] <=  G.edges[edge]['capacity'], name=f"flow_capacity_{i}_{j}")
-            # model.addConstr(edge_deltas[j, i] + edge_deltas[j, edge_indices[(edge[1], edge[0])]] <= 1, name=f"edge_delta_{i}_{j}")
-            
+    # SUM_OVER_DEMANDS[f_d,e] <= capacity_e
+    # This is a change from the original code
+    # Basically, we set flow into a client to be zero if `chi_d` is 0, so that propagates across the graph to make
+    # the flow zero everywhere.
+    # Flows are nonnegative, so this also bounds the flow of every single demand by the capacity.
+    model.addConstr(flow_vars.sum(axis=0) <= caps, **constr_name("superimposed_flow"))
+
     # Flow conservation constraints
-    for i, node in enumerate(G.nodes()):
-        # print(G.nodes[node].get('type', 'unknown'))
-        # Check if node is not a repeater
-        # Generator has no constraints and clients are sinks. 
-        if G.nodes[node]['type'] != 'repeater':
-            continue
-        for j in range(len(demands)):
-            # Flow conservation: incoming flow = outgoing flow
-            model.addConstr(
-                gp.quicksum(flow_vars[j, edge_indices[edge]] for edge in G.in_edges(node)) -
-                gp.quicksum(flow_vars[j, edge_indices[edge]] for edge in G.out_edges(node)) == 0,
-                name=f"flow_conservation_{i}_{j}"
-            )
-    
+    # Generator has no constraints and clients are sinks, so only repeaters get a row.
+    A_in, A_out = incidence_matrices(G, topo)
+    # Column e of `A` is +1 at the head and -1 at the tail of edge e
+    A = A_in - A_out
+    repeaters = [topo.node_indices[node] for node in G.nodes() if G.nodes[node]['type'] == 'repeater']
+    # One block of rows per demand over the flattened (demand, edge) flow vector
+    A_conserv = sp.kron(sp.identity(len(demands), dtype=np.int8), A[repeaters], format="csr")
+    # Flow conservation: incoming flow = outgoing flow
+    model.addMConstr(A_conserv, flow_vars.reshape(-1), '=', np.zeros(A_conserv.shape[0], dtype=np.int8), **constr_name("flow_conservation"))
+
 
     # Sink constraints
-    for i, (src, dst, qubits, thres) in enumerate(demands):
-        # Flow conservation at src
-        # This is a change from the original code
-        # Refer to capacity constraint. Flow is zero if `chi_d` is 0.
-        # This makes the program linear, which is a good improvement over bilinear.
-        # Even for ILP, this is faster than the path stuff.
-        model.addConstr(
-            gp.quicksum(flow_vars[i, edge_indices[edge]] for edge in G.out_edges(f"client_{src}")) == qubits * demand_vars[i],
-            name=f"flow_conservation_src_{i}"
-        )
-        assert len(G.out_edges(f"client_{src}")) > 0
-        # Flow conservation at dst
-        model.addConstr(
-            gp.quicksum(flow_vars[i, edge_indices[edge]] for edge in G.in_edges(f"client_{dst}")) == qubits * demand_vars[i],
-            name=f"flow_conservation_dst_{i}"
-        )
-        assert len(G.out_edges(f"client_{dst}")) > 0
-
-        model.addConstr(potentials[i, src] == 0, name=f"potential_source_{i}_{src}")
-        model.addConstr(potentials[i, dst] <= thres, name=f"potential_target_{i}_{dst}")
-        for k, edge in enumerate(G.edges()):
-            # Potential difference constraints
-            # p_v - p_u >= delta
-            model.addConstr(potentials[i, node_indices[edge[1]]] - potentials[i, node_indices[edge[0]]] >= edge_deltas[i, k], name=f"potential_difference_{i}_{k}")
+    # This is a change from the original code
+    # Refer to capacity constraint. Flow is zero if `chi_d` is 0.
+    # This makes the program linear, which is a good improvement over bilinear.
+    # Even for ILP, this is faster than the path stuff.
+    qubits = np.array([q for _, _, q, _ in demands], dtype=np.int32)
+    src_edges = [topo.client_out_idx[src] for src, *_ in demands]
+    dst_edges = [topo.client_in_idx[dst] for _, dst, *_ in demands]
+    assert all(len(topo.client_out_idx[src]) > 0 and len(topo.client_out_idx[dst]) > 0 for src, dst, *_ in demands)
+    if demands:
+        # Flow out of src
+        S_src = sink_selector(src_edges, len(G.edges()))
+        model.addConstr(S_src @ flow_vars.reshape(-1) == qubits * demand_vars, **constr_name("flow_conservation_src"))
+        # Flow into dst
+        S_dst = sink_selector(dst_edges, len(G.edges()))
+        model.addConstr(S_dst @ flow_vars.reshape(-1) == qubits * demand_vars, **constr_name("flow_conservation_dst"))
+
+    # Potential difference constraints
+    # p_v - p_u >= delta, for every demand and edge (u, v)
+    # Row (d, e) of `A_pot` is column e of `A` over the flattened (demand, node) potentials of demand d
+    if demands:
+        A_pot = sp.kron(sp.identity(len(demands), dtype=np.int8), A.T, format="csr")
+        model.addConstr(A_pot @ potentials.reshape(-1) - edge_deltas.reshape(-1) >= 0, **constr_name("potential_difference"))
 
     # Potential constraints
     # for i, (src, dst, _, thres) in enumerate(demands):
@@ -226,192 +410,562 @@ def p2p_formulation(G: nx.DiGraph, demands: list[Demand], relaxed: bool = False,
     return model, demand_vars, flow_vars, potentials, edge_deltas
 
 
-def path_formulation(G: nx.DiGraph, demands: list[Demand]):
+def shortest_paths(G: nx.DiGraph, target: str, h: int, k: int = K_PATHS) -> list[list[str]]:
+    """
+    Find up to `k` shortest simple paths from the generator to `target` with at most `h` edges.
+
+    Parameters:
+        G (nx.DiGraph): 
+            Directed graph representing the quantum network.
+        target (str): 
+            Node the paths end at.
+        h (int): 
+            Maximum number of edges on a path.
+        k (int, default=K_PATHS): 
+            Maximum number of paths.
+
+    Returns:
+        The paths in increasing order of length, as lists of nodes.
+    """
+    try:
+        # Paths are generated shortest first, so stop at the first one that is too long
+        paths = nx.shortest_simple_paths(G, "generator", target)
+        return list(itertools.islice(itertools.takewhile(lambda p: len(p) - 1 <= h, paths), k))
+    except nx.NetworkXNoPath:
+        return []
+
+def hop_bounded_path(topo: Topology, weights: np.ndarray, source: int, h: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find the cheapest walks of at most `h` edges from `source` to every node, for nonnegative edge weights.
+
+    Parameters:
+        topo (Topology): 
+            Lookups of the graph.
+        weights (np.ndarray): 
+            Weight of every edge, in edge order.
+        source (int): 
+            Index of the node the walks start at.
+        h (int): 
+            Maximum number of edges on a walk.
+
+    Returns:
+        The cost of reaching every node, and an (h, V) array of the edge entering each node at every hop count,
+        or -1 where the node is reached with fewer hops. Trace walks back with `trace_path`.
+    """
+    tails = np.array([topo.node_indices[u] for u, _ in topo.edges], dtype=np.int32)
+    heads = np.array([topo.node_indices[v] for _, v in topo.edges], dtype=np.int32)
+    dist = np.full(len(topo.node_indices), np.inf)
+    dist[source] = 0
+    pred = np.full((h, len(dist)), -1, dtype=np.int32)
+    for k in range(h):
+        cand = dist[tails] + weights
+        new = dist.copy()
+        np.minimum.at(new, heads, cand)
+        improved = np.flatnonzero((cand < dist[heads]) & (cand == new[heads]))
+        pred[k, heads[improved]] = improved
+        dist = new
+    return dist, pred
+
+def trace_path(topo: Topology, pred: np.ndarray, target: int) -> list[int]:
+    """
+    Trace the walk ending at `target` back through `pred` from `hop_bounded_path`, with any cycles cut out.
+
+    Returns:
+        The edge indices of the path, in order.
+    """
+    walk, node = [], target
+    for k in range(len(pred) - 1, -1, -1):
+        if pred[k, node] >= 0:
+            walk.append(pred[k, node])
+            node = topo.node_indices[topo.edges[pred[k, node]][0]]
+    walk.reverse()
+    # Zero-weight cycles can appear in cheapest walks, and dropping them keeps the cost
+    path, seen = [], {}
+    for e in walk:
+        tail = topo.edges[e][0]
+        if tail in seen:
+            del path[seen[tail]:]
+            seen = {topo.edges[f][0]: j for j, f in enumerate(path)}
+        seen[tail] = len(path)
+        path.append(e)
+    return path
+
+def price_paths(G: nx.DiGraph, demands: list[Demand], topo: Topology | None = None, max_rounds: int = 100, tol: float = 1e-9) -> dict:
+    """
+    Generate the paths of `path_formulation` by column generation on its LP relaxation.
+
+    The master LP starts with the shortest path of every demand leg. After every solve, the cheapest path of at most
+    `thres` edges over the capacity duals is priced for every leg, and added if its reduced cost is positive, until
+    no leg improves or `max_rounds` is reached.
+
+    Parameters:
+        G (nx.DiGraph): 
+            Directed graph representing the quantum network.
+        demands (List[Demand]): 
+            Contains source, destination clients, qubit demand between them, and distance threshold
+            for each demand.
+        topo (Topology, optional):
+            Lookups of `G`, built if not given.
+        max_rounds (int, default=100): 
+            Maximum number of pricing rounds.
+        tol (float, default=1e-9): 
+            Smallest reduced cost of a path that is added.
+
+    Returns:
+        The generated (src paths, dst paths) of every demand, as lists of nodes.
+    """
+    if topo is None:
+        topo = build_topology(G)
+    nodes = list(G.nodes())
+    generator = topo.node_indices["generator"]
+
+    model = gp.Model("PathPricing", env=gurobi_env())
+    model.Params.OutputFlag = 0
+    demand_vars = model.addVars(len(demands), ub=1, name="demand_vars")
+    model.setObjective(demand_vars.sum(), GRB.MAXIMIZE)
+    cap = [model.addLConstr(gp.LinExpr(), GRB.LESS_EQUAL, c) for c in topo.caps]
+    legs = [[model.addLConstr(-qubits * demand_vars[i], GRB.EQUAL, 0) for _ in range(2)] for i, (_, _, qubits, _) in enumerate(demands)]
+
+    paths = {i: ([], []) for i in range(len(demands))}
+    def add_path(i: int, leg: int, path: list[int]):
+        model.addVar(column=gp.Column([1.0] * (len(path) + 1), [cap[e] for e in path] + [legs[i][leg]]))
+        paths[i][leg].append([topo.edges[path[0]][0]] + [topo.edges[e][1] for e in path])
+
+    # Initial columns
+    for i, (src, dst, _, h) in enumerate(demands):
+        for leg, client in enumerate((src, dst)):
+            for path in shortest_paths(G, nodes[topo.client_indices[client]], h, 1):
+                add_path(i, leg, [topo.edge_indices[edge] for edge in itertools.pairwise(path)])
+
+    max_h = max((h for *_, h in demands), default=0)
+    for _ in range(max_rounds):
+        model.optimize()
+        # Capacity duals are nonnegative in the maximization, which keeps the pricing a shortest path problem
+        pi = np.maximum(np.array(model.getAttr("Pi", cap)), 0)
+        _, pred = hop_bounded_path(topo, pi, generator, max_h)
+        added = False
+        for i, (src, dst, _, h) in enumerate(demands):
+            for leg, client in enumerate((src, dst)):
+                target = topo.client_indices[client]
+                path = trace_path(topo, pred[:h], target)
+                if not path or topo.edges[path[-1]][1] != nodes[target]:
+                    continue
+                # Reduced cost of the path column, which has a 1 in each of its edge rows and in its leg row
+                if -(pi[path].sum() + legs[i][leg].Pi) > tol:
+                    add_path(i, leg, path)
+                    added = True
+        if not added:
+            break
+
+    return paths
+
+def path_formulation(G: nx.DiGraph, demands: list[Demand], column_generation: bool = False, topo: Topology | None = None):
     """
     Define the flow problem on a quantum hierarchical network.
 
+    Every leg of a demand may only use the candidate paths, the K_PATHS shortest ones or those priced at the root
+    by `price_paths`, which restricts the model. It has no potential-difference rows though, so unlike
+    `edge_formulation` it may use edges inside cycles, which relaxes it. Neither objective bounds the other, and
+    they can differ in either direction even on small instances.
+
     Parameters:
         G (nx.DiGraph): 
             Directed graph representing the quantum network.
         demand (List[(int, int), int, int]): 
             Contains source, destination clients, qubit demand between them, and distance threshold
             for each demand.
+        column_generation (bool, default=False):
+            Flag for whether the paths are generated by `price_paths` instead of taking the K_PATHS shortest ones.
+        topo (Topology, optional):
+            Lookups of `G`, built if not given.
 
     Returns:
         A tuple containing variables and the defined problem.
 
     """
     # Create a new model
-    model = gp.Model("QuantumFlowProblem")
+    model = gp.Model("QuantumFlowProblem", env=gurobi_env())
     
     # Variables
     # Indicator variables for each demand (chi)
-    demand_vars = model.addVars(len(demands), vtype=GRB.BINARY, name="demand_vars", ub=1)
+    demand_vars = model.addMVar(len(demands), vtype=GRB.BINARY, name="demand_vars", ub=1)
     
     # clients = list(filter(lambda x: x["type"] == "client", G.nodes))
     # print(f"Number of clients: {len(clients)}")
     
-    paths = {i: (
-        list(nx.all_simple_paths(G, source="generator", target=f"client_{src}", cutoff=h)), 
-        list(nx.all_simple_paths(G, source="generator", target=f"client_{dst}", cutoff=h))) 
-        for i, (src, dst, _, h) in enumerate(demands)
-    }
+    if topo is None:
+        topo = build_topology(G)
+    if column_generation:
+        # Integrality is only enforced on the generated paths, so this is a heuristic for the full model
+        paths = price_paths(G, demands, topo)
+    else:
+        paths = {i: (
+            shortest_paths(G, f"client_{src}", h),
+            shortest_paths(G, f"client_{dst}", h))
+            for i, (src, dst, _, h) in enumerate(demands)
+        }
     
-    paths_e = {e: [] for e in G.edges()}
-    for i, p in enumerate(paths.values()):
-        for a in itertools.pairwise(p[0]):
-            paths_e[a].append(i)
-        for b in itertools.pairwise(p[1]):
-            paths_e[b].append(i)
-            
-    print("Pathsed")
-            
-    # Flow variables for each demand and each path (f)
-    flow_vars = model.addVars(len(demands), sum(len(a) + len(b) for a, b in paths.values()), vtype=GRB.INTEGER, name="flow_vars", lb=0)
+    # Number the paths of all demands consecutively, src paths before dst paths
+    all_paths, path_demand, path_leg = [], [], []
+    for i, legs in paths.items():
+        for leg, leg_paths in enumerate(legs):
+            all_paths += leg_paths
+            path_demand += [i] * len(leg_paths)
+            path_leg += [leg] * len(leg_paths)
+    path_demand = np.array(path_demand, dtype=np.int32)
+    path_leg = np.array(path_leg, dtype=np.int8)
+
+    # Inverted index from edges to the paths that contain them
+    # Path edges are flattened into parallel (edge, path) arrays, and paths_e[e, k] is 1 if edge e is on path k
+    path_lengths = np.array([len(p) - 1 for p in all_paths], dtype=np.int32)
+    edges_arr = np.fromiter((topo.edge_indices[e] for p in all_paths for e in itertools.pairwise(p)), dtype=np.int32, count=path_lengths.sum())
+    paths_arr = np.repeat(np.arange(len(all_paths), dtype=np.int32), path_lengths)
+    paths_e = sp.csr_matrix((np.ones(len(edges_arr), dtype=np.int8), (edges_arr, paths_arr)), shape=(len(topo.edges), len(all_paths)))
+
+    # Flow variables for each path (f)
+    flow_vars = model.addMVar(len(all_paths), vtype=GRB.INTEGER, name="flow_vars", lb=0)
     
     # Objective function
     # Maximize the number of demands satisfied
-    model.setObjective(gp.quicksum(demand_vars[i] for i in range(len(demands))), GRB.MAXIMIZE)
+    model.setObjective(demand_vars.sum(), GRB.MAXIMIZE)
     
     # Constraints
     # Superimposed flow on each edge from all paths that contain it
-    for i, edge in enumerate(G.edges()):
-        # SUM_OVER_DEMANDS[chi_d * f_d,e] <= capacity_e
-        model.addConstr(gp.quicksum(flow_vars[j, k] for j in range(len(demands)) for k in paths_e[edge]) <= G.edges[edge]['capacity'], name=f"superimposed_flow_{i}")
+    # SUM_OVER_PATHS_CONTAINING_E[f_p] <= capacity_e
+    caps = topo.caps
+    model.addMConstr(paths_e, flow_vars, '<', caps, **constr_name("superimposed_flow"))
         
     # Demand atomicity
-    for j, (_, _, qubits, _) in enumerate(demands):
-        p = paths[j]
-        model.addConstr(gp.quicksum(flow_vars[j, k] for k in range(len(p[0]))) == demand_vars[j] * qubits, name=f"flow_conservation_src_{j}")
-        model.addConstr(gp.quicksum(flow_vars[j, k] for k in range(len(p[1]))) == demand_vars[j] * qubits, name=f"flow_conservation_dst_{j}")
-            
+    # Row i of `S` selects the paths of demand i, and the leg masks split them into src and dst paths
+    S = sp.csr_matrix((np.ones(len(all_paths), dtype=np.int8), (path_demand, np.arange(len(all_paths)))), shape=(len(demands), len(all_paths)))
+    S_src = S.multiply(path_leg == 0).tocsr()
+    S_dst = S.multiply(path_leg == 1).tocsr()
+    if demands:
+        qubits = np.array([q for _, _, q, _ in demands], dtype=np.int32)
+        model.addConstr(S_src @ flow_vars == qubits * demand_vars, **constr_name("flow_conservation_src"))
+        model.addConstr(S_dst @ flow_vars == qubits * demand_vars, **constr_name("flow_conservation_dst"))
+
     return model, demand_vars, flow_vars, paths, paths_e
     
 # Solve function
-def solve_flow_problem(model: gp.Model):
+def solve_flow_problem(model: gp.Model, solution_file: Path = SOLUTION_FILE, params: dict | None = None):
     """
     Solve the flow problem using Gurobi.
 
     Parameters:
     model (gurobipy.Model): 
         The Gurobi model to be solved.
+    solution_file (Path, default=SOLUTION_FILE): 
+        `.sol` file to write the solution to.
+    params (dict, optional): 
+        Gurobi parameters overriding MIP_PARAMS or LP_PARAMS, e.g. `{"Cuts": 0}`.
 
     Returns:
         The solution of the model.
     """
+    # Threads are left to the caller, which may split the cores between parallel runs
+    # Pending variables are flushed first so `IsMIP` is current
+    model.update()
+    for name, value in ((MIP_PARAMS if model.IsMIP else LP_PARAMS) | (params or {})).items():
+        model.setParam(name, value)
+
     # Optimize the model
     model.optimize()
 
     # Check if the model is feasible
     if model.status == GRB.OPTIMAL:
         # print("Optimal solution found:")
-        with open(SOLUTION_FILE, "w") as f:
-            for var in model.getVars():
-                print(f"{var.VarName}: {var.X}", file=f)
-            print(f"Objective value: {model.objVal}", file=f)
+        # Gurobi writes the objective value and every variable in one call, the file must end in `.sol`
+        model.write(str(solution_file))
             
         print("Total work?: ", model.Work)
     else:
         print("No optimal solution found.")
         return None
 
-def runtime(params: Params):
-    demand = generate_demand(params)
+def relax_flow_problem(model: gp.Model, logf=LP_RELAXED_LOG):
+    """
+    Get the LP relaxation of a solved flow problem.
+
+    Parameters:
+    model (gurobipy.Model): 
+        The integral model, after `solve_flow_problem`.
+    logf (Path, default=LP_RELAXED_LOG): 
+        Log file of the relaxed model.
+
+    Returns:
+        The relaxed model, with default parameters apart from the thread count and log file.
+    """
+    relaxed = model.relax()
+    # The copy inherits the MIP parameters, so only the thread count is kept and `solve_flow_problem` sets LP_PARAMS
+    relaxed.resetParams()
+    relaxed.Params.Threads = model.Params.Threads
+    relaxed.Params.LogFile = str(logf.absolute())
+    # Demands pruned by `edge_formulation` are only out of reach with integral deltas
+    if hasattr(model, "_unpruned_ub"):
+        relaxed_vars = relaxed.getVars()
+        for mvar, ub in model._unpruned_ub:
+            pruned = [relaxed_vars[var.index] for var in mvar.reshape(-1).tolist()]
+            relaxed.setAttr("UB", pruned, [ub] * len(pruned))
+
+    return relaxed
+
+def ensure_integral_flows(model: gp.Model, flow_vars: gp.MVar, solution_file: Path = SOLUTION_FILE, tol: float = 1e-6, params: dict | None = None) -> bool:
+    """
+    Check that a solved edge formulation has integral flows, re-solving with integer flows otherwise.
+
+    Parameters:
+    model (gurobipy.Model): 
+        The integral model, after `solve_flow_problem`.
+    flow_vars (gurobipy.MVar): 
+        Flow variables of the model, which `edge_formulation` declares continuous.
+    solution_file (Path, default=SOLUTION_FILE): 
+        File to write the solution of the re-solve to.
+    tol (float, default=1e-6): 
+        Largest distance to the nearest integer of a flow that still counts as integral.
+    params (dict, optional): 
+        Gurobi parameters of the re-solve, see `solve_flow_problem`.
+
+    Returns:
+        True if the flows were integral, False if the model was re-solved. The flows stay integer afterwards.
+    """
+    if model.SolCount == 0:
+        return True
+    flows = flow_vars.X
+    if np.abs(flows - np.round(flows)).max(initial=0) <= tol:
+        return True
+
+    flow_vars.VType = GRB.INTEGER
+    solve_flow_problem(model, solution_file, params)
+    return False
+
+def run_file(path: Path, run: int) -> Path:
+    """
+    Get the per-run variant of a log or solution file, e.g. gurobi.log -> gurobi_2.log.
+    """
+    return path.with_stem(f"{path.stem}_{run}")
+
+def clear_run_logs(logf: Path, runs: int = RUNS):
+    """
+    Truncate the per-run logs of `logf` for `runs` runs.
+    """
+    for run in range(runs):
+        with open(run_file(logf, run), "w") as _: pass
+
+def run_threads() -> int:
+    """
+    Get the thread count of one of RUNS parallel runs, so the runs together use at most all cores.
+    """
+    return max(1, (os.cpu_count() or 1) // RUNS)
+
+def lpgap_run(run: int, G: nx.DiGraph, demand: list[Demand], gurobi_params: dict | None = None, topo: Topology | None = None, start: np.ndarray | None = None) -> tuple[float, float, np.ndarray | None]:
+    """
+    Solve the exact and relaxed edge formulations of one run, returning both objective values and the exact
+    solution, which the next configuration of a sweep can pass back as `start`.
+    """
+    # Get exact LP
+    zmodel, demand_vars, flow_vars, potentials, edge_deltas = edge_formulation(G, demand, logf=run_file(LP_LOG, run), topo=topo)
+    zmodel.Params.Threads = run_threads()
+    # The previous solution is a second MIP start next to the greedy one, Gurobi discards it if it is infeasible
+    if start is not None:
+        zmodel.update()
+        zmodel.NumStart = 2
+        zmodel.Params.StartNumber = 1
+        zmodel.setAttr("Start", zmodel.getVars(), start)
+    # Solve the flow problem
+    solve_flow_problem(zmodel, run_file(SOLUTION_FILE, run), gurobi_params)
+    ensure_integral_flows(zmodel, flow_vars, run_file(SOLUTION_FILE, run), params=gurobi_params)
+    solution = np.array(zmodel.getAttr("X", zmodel.getVars())) if zmodel.SolCount > 0 else None
+
+    # Get relaxed LP from the exact model, instead of building the formulation again
+    model = relax_flow_problem(zmodel, run_file(LP_RELAXED_LOG, run))
+    # Solve the flow problem
+    solve_flow_problem(model, run_file(SOLUTION_FILE, run), gurobi_params)
+
+    return zmodel.ObjVal, model.ObjVal, solution
+
+def p2pgap_run(run: int, G: nx.DiGraph, otherG: nx.DiGraph, demand: list[Demand], gurobi_params: dict | None = None, topo: Topology | None = None) -> tuple[float, float]:
+    """
+    Solve the edge formulation and the point-to-point formulation of one run, returning both objective values.
+    """
+    # Get other LP
+    zmodel, demand_vars, flow_vars, potentials, edge_deltas = p2p_formulation(otherG, demand, logf=run_file(P2P_LOG, run))
+    zmodel.Params.Threads = run_threads()
+    # Solve the flow problem
+    solve_flow_problem(zmodel, run_file(SOLUTION_FILE, run), gurobi_params)
+
+    # Get our LP
+    model, demand_vars, flow_vars, potentials, edge_deltas = edge_formulation(G, demand, logf=run_file(LP_LOG, run), topo=topo)
+    model.Params.Threads = run_threads()
+    # Solve the flow problem
+    solve_flow_problem(model, run_file(SOLUTION_FILE, run), gurobi_params)
+    ensure_integral_flows(model, flow_vars, run_file(SOLUTION_FILE, run), params=gurobi_params)
+
+    return model.ObjVal, zmodel.ObjVal
+
+def save_result(out_file: Path, row):
+    """
+    Append a result row to the `.npy` copy of `out_file`, which the plot scripts load instead of parsing the CSV.
+    """
+    npy_file = out_file.with_suffix('.npy')
+    results = np.asarray(row, dtype=float)[None]
+    if npy_file.exists():
+        results = np.concatenate([np.load(npy_file), results])
+    np.save(npy_file, results)
+
+@functools.lru_cache(maxsize=16)
+def experiment_graph(key: GraphKey) -> tuple[nx.DiGraph, Topology]:
+    """
+    Generate the graph of an experiment with its lookups, cached so that sweeps over demand parameters (alpha,
+    mean_demand) reuse them. The returned graph is shared between calls and must not be modified.
+    """
+    G = generate_random_hqnw(key, np.random.default_rng(key.seed))
+    return G, build_topology(G)
+
+def demand_rng(params: Params) -> np.random.Generator:
+    """
+    Get the random number generator of the demands of an experiment, a stream of `params.seed` independent of the
+    graph's, so demands are the same whether the graph was generated or taken from the cache.
+    """
+    return np.random.default_rng(np.random.SeedSequence(params.seed, spawn_key=(1,)))
+
+def runtime(params: Params, gurobi_params: dict | None = None, demand: list[Demand] | None = None):
+    if demand is None:
+        demand = generate_demand(params, demand_rng(params))
     
     with open(LP_LOG, "w") as f:
         pass
 
-    G = generate_random_hqnw(params)
+    G, topo = experiment_graph(params.graph_key())
     # print(f"{params}: Generated graph with {len(G.nodes)} nodes and {len(G.edges)} edges.", file=open('graph_runtime.txt', 'a'))
 
-    for _ in range(RUNS):
-        # Define the flow problem
-        model, demand_vars, flow_vars, potentials, edge_deltas = edge_formulation(G, demand)
+    # Every run solves the same problem, so define it once and solve it from scratch each time
+    model, demand_vars, flow_vars, potentials, edge_deltas = edge_formulation(G, demand, topo=topo)
+    runtimes = np.empty(RUNS)
+    for run in range(RUNS):
+        model.reset()
         # Solve the flow problem
-        solve_flow_problem(model)
+        solve_flow_problem(model, params=gurobi_params)
+        runtimes[run] = model.Runtime
+        # A re-solve with integer flows counts towards the runtime
+        if not ensure_integral_flows(model, flow_vars, params=gurobi_params):
+            runtimes[run] += model.Runtime
+            # The next run times the continuous-flow model again
+            flow_vars.VType = GRB.CONTINUOUS
         
     # Taking too long
     # path_model, path_demand_vars, path_flow_vars, paths, paths_e = path_formulation(G, demand)
     # solve_flow_problem(path_model)
     
-    df = glt.get_dataframe([str(LP_LOG.absolute())])
     with open(OUT_RUNTIME_FILE, "a") as f:
-        print(f"{df["Runtime"].mean():.3}", file=f) # type: ignore
+        print(f"{runtimes.mean():.3}", file=f)
+    save_result(OUT_RUNTIME_FILE, runtimes.mean())
 
-def lpgap(params: Params):
-    with open(LP_LOG, "w") as _: pass
-    with open(LP_RELAXED_LOG, "w") as _: pass
-    
-    G = generate_random_hqnw(params)
+def lpgap(params: Params, gurobi_params: dict | None = None, demands: list[list[Demand]] | None = None, starts: list[np.ndarray | None] | None = None, pool: multiprocessing.pool.Pool | None = None) -> list[np.ndarray | None]:
+    """
+    Run the LP gap experiment of `params`, returning the exact solution of every run.
+
+    The solutions can be passed as `starts` of the next configuration of a sweep over alpha or mean_demand, whose
+    runs have the same graph and the same number of demands, so the models have the same variables. The runs are
+    solved in `pool`, see `pool_starmap`. Raises ValueError if `starts` is not one solution per run of `demands`.
+    """
+    G, topo = experiment_graph(params.graph_key())
     # print(f"{params}: Generated graph with {len(G.nodes)} nodes and {len(G.edges)} edges.", file=open('graph_lpgap.txt', 'a'))
     # G = nx.read_gml("experiments/lpgap/graph.gml")
-        
-    for _ in range(RUNS):
-        demand = generate_demand(params)
-        
-        # Get exact LP
-        zmodel, demand_vars, flow_vars, potentials, edge_deltas = edge_formulation(G, demand)
-        # Solve the flow problem
-        solve_flow_problem(zmodel)
-    
-        # Get relaxed LP
-        model, demand_vars, flow_vars, potentials, edge_deltas = edge_formulation(G, demand, True)
-        # Solve the flow problem
-        solve_flow_problem(model)
-        
-    df = glt.get_dataframe([str(LP_LOG.absolute())])
-    df_relaxed = glt.get_dataframe([str(LP_RELAXED_LOG.absolute())])
+
+    # Demands are drawn here, so the runs see the same random stream as a serial sweep
+    if demands is None:
+        rng = demand_rng(params)
+        demands = [generate_demand(params, rng) for _ in range(RUNS)]
+    if starts is None:
+        starts = [None] * len(demands)
+    elif len(starts) != len(demands):
+        raise ValueError(f"Got {len(starts)} starts for {len(demands)} runs")
+    clear_run_logs(LP_LOG, len(demands))
+    clear_run_logs(LP_RELAXED_LOG, len(demands))
+    results = pool_starmap(pool, lpgap_run, [(run, G, demand, gurobi_params, topo, start) for run, (demand, start) in enumerate(zip(demands, starts))])
+    # Columns are the exact and relaxed objective values of every run
+    objs = np.array([result[:2] for result in results])
 
     # print(zmodel.ObjVal, model.ObjVal)
     with open(OUT_LPGAP_FILE, "a") as f:
-        print(f"{df["ObjVal"].mean()},{df_relaxed["ObjVal"].mean()}", file=f) # type: ignore
+        print(f"{objs[:, 0].mean()},{objs[:, 1].mean()}", file=f)
+    save_result(OUT_LPGAP_FILE, objs.mean(axis=0))
+    return [result[2] for result in results]
 
-def p2pgap(params: Params):
-    with open(LP_LOG, "w") as _: pass
-    with open(P2P_LOG, "w") as _: pass
-    
-    G = generate_random_hqnw(params)
+def p2pgap(params: Params, gurobi_params: dict | None = None, demands: list[list[Demand]] | None = None, pool: multiprocessing.pool.Pool | None = None):
+    G, topo = experiment_graph(params.graph_key())
     otherG: nx.DiGraph = deepcopy(G)
     
     for edge in G.edges():
         otherG.add_edge(edge[1], edge[0], capacity=G.edges[edge]['capacity'])
         
     otherG.nodes['generator']['type'] = 'repeater'
-    print(G, len(G.out_edges("generator")))
-    print(otherG)
     
     # print(f"{params}: Generated graph with {len(G.nodes)} nodes and {len(G.edges)} edges.", file=open('graph_p2pgap.txt', 'a'))
     
-    for _ in range(RUNS):
-        demand = generate_demand(params)
-        
-        # Get other LP
-        zmodel, demand_vars, flow_vars, potentials, edge_deltas = p2p_formulation(otherG, demand, logf=P2P_LOG)
-        # Solve the flow problem
-        solve_flow_problem(zmodel)
-    
-        # Get our LP
-        model, demand_vars, flow_vars, potentials, edge_deltas = edge_formulation(G, demand)
-        # Solve the flow problem
-        solve_flow_problem(model)
-        
-    df = glt.get_dataframe([str(LP_LOG.absolute())])
-    df_p2p = glt.get_dataframe([str(P2P_LOG.absolute())])
+    if demands is None:
+        rng = demand_rng(params)
+        demands = [generate_demand(params, rng) for _ in range(RUNS)]
+    clear_run_logs(LP_LOG, len(demands))
+    clear_run_logs(P2P_LOG, len(demands))
+    # Columns are the edge and point-to-point objective values of every run
+    objs = np.array(pool_starmap(pool, p2pgap_run, [(run, G, otherG, demand, gurobi_params, topo) for run, demand in enumerate(demands)]))
 
-    print(zmodel.ObjVal, model.ObjVal)
-    # with open(OUT_P2PGAP_FILE, "a") as f:
-    #     print(f"{df["ObjVal"].mean()},{df_relaxed["ObjVal"].mean()}", file=f) # type: ignore
-    # df = glt.get_dataframe([str(LP_LOG.absolute())])
     with open(OUT_P2PGAP_FILE, "a") as f:
-        print(f"{df["ObjVal"].mean():.3},{df_p2p["ObjVal"].mean():.3}", file=f) # type: ignore
+        print(f"{objs[:, 0].mean():.3},{objs[:, 1].mean():.3}", file=f)
+
+EXPERIMENTS = {"runtime": runtime, "lpgap": lpgap, "p2pgap": p2pgap}
+
+def run_experiment(mode: str, params: Params, demands=None, gurobi_params: dict | None = None, **kwargs):
+    """
+    Run one configuration of an experiment in this process, so sweeps share the Gurobi environment and graph cache.
+
+    Parameters:
+        mode (str):
+            Experiment to run, one of EXPERIMENTS.
+        params (Params):
+            Parameters of the graph and demands.
+        demands (optional):
+            Demands to solve instead of drawing them from `params`, a list of demands for `runtime` and one such
+            list per run for `lpgap` and `p2pgap`.
+        gurobi_params (dict, optional):
+            Gurobi parameters overriding the defaults, see `solve_flow_problem`.
+        kwargs:
+            Further arguments of the experiment, e.g. `starts` of `lpgap` or the `pool` of `lpgap` and `p2pgap`.
+
+    Returns:
+        The return value of the experiment.
+    """
+    return EXPERIMENTS[mode](params, gurobi_params, demands, **kwargs)
+
+INT_PATTERN = re.compile(r"[+-]?\d+")
+FLOAT_PATTERN = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?")
+
+def parse_gurobi_params(args: list[str]) -> dict:
+    """
+    Parse `Name=value` command line arguments into Gurobi parameters, e.g. `Cuts=0 Heuristics=0.5`.
+
+    Values that are integers become ints, other numbers floats, and anything else stays a string. Exits with an
+    error naming the argument if it is not of the form `Name=value`.
+    """
+    gurobi_params = {}
+    for arg in args:
+        name, sep, value = arg.partition("=")
+        if not sep or not name or not value:
+            sys.exit(f"Invalid Gurobi parameter {arg!r}, expected Name=value")
+        if INT_PATTERN.fullmatch(value):
+            gurobi_params[name] = int(value)
+        elif FLOAT_PATTERN.fullmatch(value):
+            gurobi_params[name] = float(value)
+        else:
+            gurobi_params[name] = value
+    return gurobi_params
 
 if __name__ == "__main__":
     params = Params(str(INP_FILE.absolute()))
+    # Any further arguments override the default Gurobi parameters of the experiment
+    gurobi_params = parse_gurobi_params(sys.argv[2:])
 
-    match sys.argv[1]: 
-        case "runtime":
-            runtime(params)
-        case "lpgap":
-            lpgap(params)
-        case "p2pgap":
-            p2pgap(params)
+    if sys.argv[1] in EXPERIMENTS:
+        run_experiment(sys.argv[1], params, gurobi_params=gurobi_params)
@@ -1,7 +1,7 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from constants import *
-df = np.loadtxt(Path(__file__).parent / Path('out.csv'), delimiter=",", dtype=float)
+df = np.load(Path(__file__).parent / Path('out.npy'))
 
 print(df.T)
 
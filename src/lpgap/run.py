@@ -1,16 +1,23 @@
 # Imports
 import subprocess
+import sys
 from constants import *
+from utils.gen_graph import Params
+import gur_solver
 
 ALPHA_LIST = [0.5, 1.0, 1.5, 2.0, 2.5, 3.0]
 
-# Run the experiments
-with open(OUT_LPGAP_FILE, 'w') as fh:
-    fh.truncate(0)
-for alpha in ALPHA_LIST:
-    with open(INP_FILE, 'w') as fh:
-        fh.write(f'20 300 0.05 0.35 0.2 10 7 {alpha}')
-    subprocess.run(['python', str(SRC_FILE), 'lpgap'], shell=True)
+if __name__ == "__main__":
+    # Run the experiments
+    # Every configuration is solved in this process, and its runs are spread over one pool for the whole sweep
+    with open(OUT_LPGAP_FILE, 'w') as fh:
+        fh.truncate(0)
+    OUT_LPGAP_FILE.with_suffix('.npy').unlink(missing_ok=True)
+    # Configurations only differ in alpha, so each one is warm-started from the solutions of the previous one
+    starts = None
+    with gur_solver.run_pool() as pool:
+        for alpha in ALPHA_LIST:
+            starts = gur_solver.run_experiment('lpgap', Params.from_line(f'20 300 0.05 0.35 0.2 10 7 {alpha}'), starts=starts, pool=pool)
 
-# Generate plots
-subprocess.run(['python', PLT_LPGAP_FILE], shell=True)
\ No newline at end of file
+    # Generate plots
+    subprocess.run([sys.executable, '-m', 'lpgap.plot'], cwd=SRC_DIR)
@@ -1,45 +1,35 @@
 # Imports
 import subprocess
+import sys
 from constants import *
-import os
+from utils.gen_graph import Params
+import multiprocessing.pool
+import gur_solver
 
 # Constants
 NUM_CLIENTS = [10, 15, 20, 25, 30]
 NUM_REPEATERS = [250, 300, 350, 400, 450]
 REP_COEFF = [0.01, 0.02, 0.03, 0.04, 0.05]
 
-# Number of clients
-with open(OUT_RUNTIME_FILE, 'w') as fh:
-    fh.truncate(0)
-for num_clients in NUM_CLIENTS:
-    with open(INP_FILE, 'w') as fh:
-        fh.write(f'{num_clients} 300 0.03 0.25 0.2 10 7')
-    # subprocess.run(['python', str(SRC_FILE), 'p2pgap'], shell=True)
-    os.system(f'python {SRC_FILE} p2pgap')
+def sweep(lines: list[str], plot: str, pool: multiprocessing.pool.Pool):
+    """
+    Solve every configuration in this process, with its runs spread over `pool`.
+    """
+    with open(OUT_P2PGAP_FILE, 'w') as fh:
+        fh.truncate(0)
+    for line in lines:
+        gur_solver.run_experiment('p2pgap', Params.from_line(line), pool=pool)
 
-# subprocess.run(['python', PLT_P2PGAP_FILE, 'clients'], shell=True)
-os.system(f'python {PLT_P2PGAP_FILE} clients')
+    subprocess.run([sys.executable, '-m', 'p2pgap.plot', plot], cwd=SRC_DIR)
 
-# Number of repeaters
-with open(OUT_RUNTIME_FILE, 'w') as fh:
-    fh.truncate(0)
-for num_repeaters in NUM_REPEATERS:
-    with open(INP_FILE, 'w') as fh:
-        fh.write(f'18 {num_repeaters} 0.03 0.25 0.2 10 7')
-    # subprocess.run(['python', str(SRC_FILE), 'p2pgap'], shell=True)
-    os.system(f'python {SRC_FILE} p2pgap')
+if __name__ == "__main__":
+    # One pool for all sweeps, so its workers keep their imports and Gurobi environments
+    with gur_solver.run_pool() as pool:
+        # Number of clients
+        sweep([f'{num_clients} 300 0.03 0.25 0.2 10 7' for num_clients in NUM_CLIENTS], 'clients', pool)
 
-# subprocess.run(['python', PLT_P2PGAP_FILE, 'repeaters'], shell=True)
-os.system(f'python {PLT_P2PGAP_FILE} repeaters')
+        # Number of repeaters
+        sweep([f'18 {num_repeaters} 0.03 0.25 0.2 10 7' for num_repeaters in NUM_REPEATERS], 'repeaters', pool)
 
-# Repeater coefficients
-with open(OUT_RUNTIME_FILE, 'w') as fh:
-    fh.truncate(0)
-for rep_coeff in REP_COEFF:
-    with open(INP_FILE, 'w') as fh:
-        fh.write(f'15 300 {rep_coeff} 0.25 0.2 10 7')
-    # subprocess.run(['python', str(SRC_FILE), 'p2pgap'], shell=True)
-    os.system(f'python {SRC_FILE} p2pgap')
-
-# subprocess.run(['python', PLT_P2PGAP_FILE, 'rep_coeff'], shell=True)
-os.system(f'python {PLT_P2PGAP_FILE} rep_coeff')
+        # Repeater coefficients
+        sweep([f'15 300 {rep_coeff} 0.25 0.2 10 7' for rep_coeff in REP_COEFF], 'rep_coeff', pool)
@@ -9,7 +9,7 @@ ranges = {
     "rep_coeff": ([0.01, 0.02, 0.03, 0.04, 0.05], "Repeater Edge Density"),
 }
 
-df = np.loadtxt(Path(__file__).parent / Path('out.csv'), delimiter=",", dtype=float)
+df = np.load(Path(__file__).parent / Path('out.npy'))
 
 a = sys.argv[1]
 s = ranges[a]
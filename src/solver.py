@@ -1,7 +1,9 @@
 # Define and solve flow problem on a quantum hierarchical network
+import sys
 import networkx as nx
 import cvxpy as cp
 import numpy as np
+import scipy.sparse as sp
 
 # Define Problem class
 def define_flow_problem(G: nx.DiGraph, demand: list[tuple[int, int], int, int]):
@@ -38,89 +40,134 @@ def define_flow_problem(G: nx.DiGraph, demand: list[tuple[int, int], int, int]):
     # Maximize the number of demands satisfied
     objective = cp.Maximize(cp.sum(demand_vars))
 
-    # Mapping edges to indices
-    edge_indices = {edge: i for i, edge in enumerate(G.edges())}
     # Mapping nodes to indices
     node_indices = {node: i for i, node in enumerate(G.nodes())}
 
+    # Incidence matrices (|N| x |E|) and capacity vector (|E|)
+    heads = np.fromiter((node_indices[v] for _, v in G.edges()), dtype=np.int32, count=len(G.edges()))
+    tails = np.fromiter((node_indices[u] for u, _ in G.edges()), dtype=np.int32, count=len(G.edges()))
+    edge_range = np.arange(len(G.edges()))
+    shape = (len(G.nodes()), len(G.edges()))
+    A_in = sp.csr_matrix((np.ones(len(edge_range)), (heads, edge_range)), shape=shape)
+    A_out = sp.csr_matrix((np.ones(len(edge_range)), (tails, edge_range)), shape=shape)
+
+    # Node masks
+    node_types = np.array([G.nodes[node]['type'] for node in G.nodes()])
+    repeater_mask = node_types == 'repeater'
+    generator_mask = node_types == 'generator'
+
+    # Source and destination client of each demand
+    src_idx = np.fromiter((node_indices[f"client_{src}"] for src, _, _, _ in demand), dtype=np.int32, count=len(demand))
+    dst_idx = np.fromiter((node_indices[f"client_{dst}"] for _, dst, _, _ in demand), dtype=np.int32, count=len(demand))
+
+    # Parameters
+    # Data that changes between solves on the same graph, so the problem only has to be canonicalized once
+    qubits = cp.Parameter(len(demand), nonneg=True, name="qubits")
+    thres = cp.Parameter(len(demand), nonneg=True, name="thres")
+    cap = cp.Parameter(len(G.edges()), nonneg=True, name="cap")
+
     # Constraints
     constraints = []
 
     # Restrict deltas less than 1
-    # for i, _ in enumerate(demand):
-    #    for j, _ in enumerate(G.edges()):
-    #        constraints.append(edge_deltas[i, j] <= 1)
+    # constraints.append(edge_deltas <= 1)
+
+    # Demand indicators are at most 1
+    constraints.append(demand_vars <= 1)
 
     # Superimposed flow on each edge
-    superimposed_constraints = []
-    for i, edge in enumerate(G.edges()):
-        # chi_d * f_d,e <= capacity_e
-        for j, (src, dst, _, _) in enumerate(demand):
-            superimposed_constraints.append(
-                    demand_vars[j] * flow_vars[j, i] <= G.edges[edge]['capacity']
-                    )
-    constraints += superimposed_constraints
-
-    # Flow conservation constraints for each demand
-    for j, (src, dst, qubits, _) in enumerate(demand):
-        # Flow conservation at repeaters
-        for node in G.nodes():
-            if G.nodes[node]['type'] == 'repeater':
-                # Get all indices of edges connected to the node
-                in_edges = [edge_indices[edge] for edge in G.in_edges(node)]
-                out_edges = [edge_indices[edge] for edge in G.out_edges(node)]
-
-                flow_in = cp.sum(flow_vars[j, in_edges])
-                flow_out = cp.sum(flow_vars[j, out_edges])
-                constraints.append(flow_in == flow_out)
-
-        # Flow conservation at clients
-        in_src_edges = [edge_indices[edge] for edge in G.in_edges(f"client_{src}")]
-        in_dst_edges = [edge_indices[edge] for edge in G.in_edges(f"client_{dst}")]
-
-        flow_in_src = cp.sum(flow_vars[j, in_src_edges])
-        flow_in_dst = cp.sum(flow_vars[j, in_dst_edges])
-        constraints.append(flow_in_src == qubits)
-        constraints.append(flow_in_dst == qubits)
-
-        # Indicator flow constraints
-        for k, edge in enumerate(G.edges()):
-            constraints.append(flow_vars[j, k] <= edge_deltas[j, k] * G.edges[edge]['capacity'])
+    # SUM_OVER_DEMANDS[f_d,e] <= capacity_e
+    # Flow into a client is zero if `chi_d` is 0 (see sink constraints), which propagates across the graph to make
+    # the flow zero everywhere, so the bilinear chi_d * f_d,e term is not needed.
+    constraints.append(cp.sum(flow_vars, axis=0) <= cap)
+
+    # Flow conservation at repeaters: incoming flow = outgoing flow
+    net_flow = flow_vars @ (A_in - A_out).T
+    if repeater_mask.any():
+        constraints.append(net_flow[:, np.flatnonzero(repeater_mask)] == 0)
+
+    # Flow conservation at clients
+    # Flow is zero if `chi_d` is 0, which keeps the program linear.
+    # Row j of the masks selects the edges into the src (dst) client of demand j, summed along axis 1
+    flow_in_src = cp.sum(cp.multiply(flow_vars, A_in[src_idx]), axis=1)
+    flow_in_dst = cp.sum(cp.multiply(flow_vars, A_in[dst_idx]), axis=1)
+    constraints.append(flow_in_src == cp.multiply(qubits, demand_vars))
+    constraints.append(flow_in_dst == cp.multiply(qubits, demand_vars))
+
+    # Indicator flow constraints
+    constraints.append(flow_vars <= cp.multiply(edge_deltas, cap[None, :]))
 
     # Potential constraints
-    for j, (src, dst, _, thres) in enumerate(demand):
-        # Potential difference constraints
-        for node in G.nodes():
-            node_idx = node_indices[node]
-            if G.nodes[node]['type'] == 'generator':
-                constraints.append(potentials[j, node_idx] == 0)
-            elif G.nodes[node]['type'] == 'client':
-                if node == f"client_{src}" or node == f"client_{dst}":
-                    constraints.append(potentials[j, node_idx] <= thres)
-
-        for edge in G.edges():
-            node_id0 = node_indices[edge[0]]
-            node_id1 = node_indices[edge[1]]
-            edge_id = edge_indices[edge]
-            constraints.append(potentials[j, node_id1] >= potentials[j, node_id0] + G.edges[edge]['capacity'] * edge_deltas[j, edge_id])
+    constraints.append(potentials[:, np.flatnonzero(generator_mask)] == 0)
+    constraints.append(potentials[np.arange(len(demand)), src_idx] <= thres)
+    constraints.append(potentials[np.arange(len(demand)), dst_idx] <= thres)
+
+    # Potential difference constraints
+    # p_v >= p_u + capacity_e * delta_e
+    constraints.append(potentials @ (A_in - A_out) >= cp.multiply(edge_deltas, cap[None, :]))
 
     # Return the all variables and the problem
     problem = cp.Problem(objective, constraints)
+    update_flow_problem(problem, demand, G)
     return demand_vars, flow_vars, edge_deltas, potentials, problem
 
-def solve_flow_problem(problem: cp.Problem):
+def update_flow_problem(problem: cp.Problem, demand: list[tuple[int, int], int, int], G: nx.DiGraph | None = None):
+    """
+    Update the parameters of a defined flow problem in place.
+
+    Parameters:
+    problem (cp.Problem): 
+        The flow problem returned by `define_flow_problem`.
+    demand (List[(int, int), int, int]): 
+        New qubit demands and distance thresholds. Sources and destinations must match the ones the problem was
+        defined with.
+    G (nx.DiGraph, optional): 
+        Graph to read new edge capacities from.
+    """
+    problem.param_dict["qubits"].value = np.array([qubits for _, _, qubits, _ in demand], dtype=float)
+    problem.param_dict["thres"].value = np.array([thres for _, _, _, thres in demand], dtype=float)
+    if G is not None:
+        problem.param_dict["cap"].value = np.array([G.edges[edge]['capacity'] for edge in G.edges()], dtype=float)
+
+def generate_flow_solver(problem: cp.Problem, code_dir: str = "solver_gen") -> str:
+    """
+    Generate a custom C solver for the flow problem with CVXPYgen.
+
+    Parameters:
+    problem (cp.Problem): 
+        The flow problem returned by `define_flow_problem`.
+    code_dir (str, default="solver_gen"): 
+        Directory to write the generated code to.
+
+    Returns:
+        The method name to pass to `solve_flow_problem`.
+    """
+    import importlib
+    from cvxpygen import cpg
+
+    cpg.generate_code(problem, code_dir=code_dir)
+    cpg_solver = importlib.import_module(f"{code_dir}.cpg_solver")
+    problem.register_solve("CPG", cpg_solver.cpg_solve)
+    return "CPG"
+
+def solve_flow_problem(problem: cp.Problem, method: str | None = None):
     """
     Solve the flow problem on a quantum hierarchical network.
 
     Parameters:
     problem (cp.Problem): 
         The defined flow problem.
+    method (str, optional): 
+        Registered solve method, e.g. the one returned by `generate_flow_solver`.
 
     Returns:
         A tuple containing the optimal value and the optimal variables.
     """
     # Solve the problem
-    problem.solve()
+    if method is None:
+        problem.solve()
+    else:
+        problem.solve(method=method)
 
     # Get the optimal value and variables
     optimal_value = problem.value
@@ -154,6 +201,13 @@ if __name__ == "__main__":
     print("Edge deltas:", edge_deltas)
     print("Potentials:", potentials)
 
+    # Re-solve with new demands, without defining the problem again
+    # With --codegen the re-solve goes through a solver generated by CVXPYgen, which needs cvxpygen and a C compiler
+    method = generate_flow_solver(problem) if "--codegen" in sys.argv[1:] else None
+    update_flow_problem(problem, [(0, 1, 4, 3), (1, 2, 6, 3), (0, 2, 2, 2)])
+    optimal_value, *_ = solve_flow_problem(problem, method)
+    print("Optimal value (updated demand):", optimal_value)
+
 
 
     
@@ -1,13 +1,16 @@
 from collections import namedtuple
-import random
+import numpy as np
 from .gen_graph import Params
 import math
 
 Demand = namedtuple('Demand', ['u', 'v', 'd', 'f'])
 
-def generate_demand(params: Params) -> list[Demand]:
-    return [Demand(
-        i, (i+1)%params.num_clients, 
-        math.ceil(1 + random.expovariate(1/params.mean_demand)), 
-        math.ceil(abs(random.gauss(params.alpha*math.sqrt(params.num_repeaters), 5)))
-    ) for i in range(params.num_clients)]
\ No newline at end of file
+def generate_demand(params: Params, rng: np.random.Generator | None = None) -> list[Demand]:
+    if rng is None:
+        rng = np.random.default_rng(params.seed)
+    # One draw per quantity for all clients
+    d = np.ceil(1 + rng.exponential(params.mean_demand, size=params.num_clients)).astype(int)
+    f = np.ceil(np.abs(rng.normal(params.alpha*math.sqrt(params.num_repeaters), 5, size=params.num_clients))).astype(int)
+    u = np.arange(params.num_clients)
+    v = (u+1)%params.num_clients
+    return [Demand(*demand) for demand in zip(u.tolist(), v.tolist(), d.tolist(), f.tolist())]
\ No newline at end of file
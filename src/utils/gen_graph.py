@@ -1,11 +1,11 @@
 # Generate a random directed graph with a given number of nodes and edges
-import random
+from collections import namedtuple, deque
+import numpy as np
 import networkx as nx
-import math
 import matplotlib.pyplot as plt
 
-# Seed the random number generator
-random.seed(42)
+# Parameters a generated graph depends on, hashable so that graphs can be cached by them
+GraphKey = namedtuple('GraphKey', ['num_clients', 'num_repeaters', 'rep_coeff', 'gen_coeff', 'client_coeff', 'mean_cap', 'seed'])
 
 class Params:
     """
@@ -21,30 +21,54 @@ class Params:
     #     self.mean_demand = mean_demand
     #     self.alpha = alpha
         
-    def __init__(self, fname: str):
+    def __init__(self, fname: str | None = None):
         """
-        Initialize parameters from a file.
+        Initialize parameters from a file, or leave them unset if no file is given (see `from_line`).
         """
-        with open(fname, 'r') as f:
-            lines = f.readlines()[0].split(' ')
-            self.num_clients = int(lines[0].strip())
-            self.num_repeaters = int(lines[1].strip())
-            self.rep_coeff = float(lines[2].strip())
-            self.gen_coeff = float(lines[3].strip())
-            self.client_coeff = float(lines[4].strip())
-            self.mean_cap = int(lines[5].strip())
-            self.mean_demand = int(lines[6].strip())
-            if len(lines) > 7:
-                self.alpha = float(lines[7].strip())
-            else:
-                self.alpha = 2
+        if fname is not None:
+            with open(fname, 'r') as f:
+                self._parse(f.readlines()[0])
+
+    @classmethod
+    def from_line(cls, line: str) -> "Params":
+        """
+        Initialize parameters from a line in the format of the parameters file.
+        """
+        params = cls()
+        params._parse(line)
+        return params
+
+    def _parse(self, line: str):
+        lines = line.split(' ')
+        self.num_clients = int(lines[0].strip())
+        self.num_repeaters = int(lines[1].strip())
+        self.rep_coeff = float(lines[2].strip())
+        self.gen_coeff = float(lines[3].strip())
+        self.client_coeff = float(lines[4].strip())
+        self.mean_cap = int(lines[5].strip())
+        self.mean_demand = int(lines[6].strip())
+        if len(lines) > 7:
+            self.alpha = float(lines[7].strip())
+        else:
+            self.alpha = 2
+        # Seed of the random number generator of an experiment
+        if len(lines) > 8:
+            self.seed = int(lines[8].strip())
+        else:
+            self.seed = 42
     
+    def graph_key(self) -> GraphKey:
+        """
+        Get the parameters of the graph, leaving out those that only affect the demands.
+        """
+        return GraphKey(self.num_clients, self.num_repeaters, self.rep_coeff, self.gen_coeff, self.client_coeff, self.mean_cap, self.seed)
+
     def __str__(self) -> str:
         return f"Params(num_clients={self.num_clients}, num_repeaters={self.num_repeaters}, rep_coeff={self.rep_coeff}, gen_coeff={self.gen_coeff}, client_coeff={self.client_coeff}, mean_cap={self.mean_cap}, demand={self.mean_demand})"
         
 
 # Generate random hierarchical quantum network directional graph with capacities for each edge
-def generate_random_hqnw(params: Params) -> nx.DiGraph:
+def generate_random_hqnw(params: Params | GraphKey, rng: np.random.Generator | None = None) -> nx.DiGraph:
     """
     Generate a random hierarchical quantum network directional graph with capacities for each edge.
 
@@ -55,6 +79,7 @@ def generate_random_hqnw(params: Params) -> nx.DiGraph:
         gen_coeff (float): Coefficient for the number of generators.
         client_coeff (float): Coefficient for the number of clients.
         mean_cap (int): Mean capacity for the edges.
+        rng (np.random.Generator, optional): Random number generator, defaults to one seeded with `params.seed`.
 
     Notes:
     - Coefficients are a measure of controlling the number of edges in the graph.
@@ -63,50 +88,59 @@ def generate_random_hqnw(params: Params) -> nx.DiGraph:
         nx.DiGraph: A directed graph with capacities for each edge.
     """
 
+    if rng is None:
+        rng = np.random.default_rng(params.seed)
+
     # Create a directed graph
     G = nx.DiGraph()
 
+    R, C = params.num_repeaters, params.num_clients
+
     # Add nodes for clients, repeaters, and generators
-    for i in range(params.num_clients):
-        G.add_node(f"client_{i}", type="client")
-    for i in range(params.num_repeaters):
-        G.add_node(f"repeater_{i}", type="repeater")
+    # Names are formatted once here and indexed by the sampled edges below
+    clients = [f"client_{i}" for i in range(C)]
+    repeaters = [f"repeater_{i}" for i in range(R)]
+    G.add_nodes_from(clients, type="client")
+    G.add_nodes_from(repeaters, type="repeater")
     G.add_node("generator", type="generator")
 
     # Add edges from generator to repeaters
-    for i in range(params.num_repeaters):
-        if random.random() < params.gen_coeff:
-            # Changed to expo to avoid negative capacity
-            # Higher capacity for generator to repeater edges
-            capacity = math.ceil(random.expovariate(0.618/params.mean_cap)) + 1
-            G.add_edge("generator", f"repeater_{i}", capacity=capacity)
+    mask = rng.random(R) < params.gen_coeff
+    # Changed to expo to avoid negative capacity
+    # Higher capacity for generator to repeater edges
+    caps = np.ceil(rng.exponential(params.mean_cap / 0.618, size=R)).astype(int) + 1
+    G.add_edges_from(("generator", repeaters[i], {"capacity": c}) for i, c in zip(np.flatnonzero(mask).tolist(), caps[mask].tolist()))
 
     # Add edges from repeaters to other repeaters
-    for i in range(params.num_repeaters):
-        for j in range(params.num_repeaters):
-            if i != j and random.random() < params.rep_coeff:
-                # Changed to expo to avoid negative capacity
-                capacity = math.ceil(random.expovariate(1/params.mean_cap)) + 1
-                G.add_edge(f"repeater_{i}", f"repeater_{j}", capacity=capacity)
+    mask = rng.random((R, R)) < params.rep_coeff
+    np.fill_diagonal(mask, False)
+    # Changed to expo to avoid negative capacity
+    caps = np.ceil(rng.exponential(params.mean_cap, size=(R, R))).astype(int) + 1
+    G.add_edges_from((repeaters[i], repeaters[j], {"capacity": c}) for i, j, c in zip(*(idx.tolist() for idx in np.nonzero(mask)), caps[mask].tolist()))
 
     # Add edges from repeaters to clients
-    for i in range(params.num_clients):
-        isolated = True
-        while isolated:
-            for j in range(params.num_repeaters):
-                if random.random() < params.client_coeff:
-                    isolated = False
-                    # Changed to expo to avoid negative capacity
-                    capacity = math.ceil(random.expovariate(1/params.mean_cap)) + 1
-                    G.add_edge(f"repeater_{j}", f"client_{i}", capacity=capacity)
+    mask = rng.random((R, C)) < params.client_coeff
+    # Clients left without a repeater are connected to one chosen at random
+    isolated = np.flatnonzero(~mask.any(axis=0))
+    if R > 0:
+        mask[rng.integers(0, R, size=len(isolated)), isolated] = True
+    # Changed to expo to avoid negative capacity
+    caps = np.ceil(rng.exponential(params.mean_cap, size=(R, C))).astype(int) + 1
+    G.add_edges_from((repeaters[j], clients[i], {"capacity": c}) for j, i, c in zip(*(idx.tolist() for idx in np.nonzero(mask)), caps[mask].tolist()))
 
     # Remove self-loops
     G.remove_edges_from(nx.selfloop_edges(G))
 
     # Remove repeater nodes with no paths to clients
-    for node in list(G.nodes):
-        if G.nodes[node]["type"] == "repeater" and not any(G.has_edge(node, f"client_{j}") for j in range(params.num_clients)):
-            G.remove_node(node)
+    # One reverse BFS from all clients at once, so every edge is scanned once instead of once per client
+    reachable = set(clients)
+    queue = deque(reachable)
+    while queue:
+        for pred in G.predecessors(queue.popleft()):
+            if pred not in reachable:
+                reachable.add(pred)
+                queue.append(pred)
+    G.remove_nodes_from([node for node, data in G.nodes(data=True) if data["type"] == "repeater" and node not in reachable])
 
     # Return the generated graph
     return G
@@ -0,0 +1,55 @@
+# Index arrays for the graph topology, computed once per graph
+from collections import namedtuple
+import numpy as np
+import scipy.sparse as sp
+import networkx as nx
+
+Topology = namedtuple('Topology', ['edges', 'edge_indices', 'node_indices', 'client_indices', 'client_in_idx', 'client_out_idx', 'caps'])
+
+def build_topology(G: nx.DiGraph) -> Topology:
+    """
+    Precompute the edge and node lookups used while building flow models.
+
+    Parameters:
+        G (nx.DiGraph):
+            Directed graph representing the quantum network.
+
+    Returns:
+        Topology: Edge list and edge/node to index mappings. The client_* fields hold the node index of every
+        client and the indices of its incoming and outgoing edges as int32 arrays, keyed by its integer id, so
+        demands can be looked up without formatting node names. `caps` holds the edge capacities as an int32 array
+        in edge order.
+    """
+    edges = list(G.edges())
+    edge_indices = {edge: i for i, edge in enumerate(edges)}
+    node_indices = {node: i for i, node in enumerate(G.nodes())}
+    clients = {i: f"client_{i}" for i in range(sum(1 for node in G.nodes() if G.nodes[node]['type'] == 'client'))}
+    client_indices = {i: node_indices[node] for i, node in clients.items()}
+    client_in_idx = {i: np.array([edge_indices[edge] for edge in G.in_edges(node)], dtype=np.int32) for i, node in clients.items()}
+    client_out_idx = {i: np.array([edge_indices[edge] for edge in G.out_edges(node)], dtype=np.int32) for i, node in clients.items()}
+    caps = np.fromiter((capacity for *_, capacity in G.edges(data='capacity')), dtype=np.int32, count=len(edges))
+    return Topology(edges, edge_indices, node_indices, client_indices, client_in_idx, client_out_idx, caps)
+
+def incidence_matrices(G: nx.DiGraph, topo: Topology) -> tuple[sp.csr_matrix, sp.csr_matrix]:
+    """
+    Build the node-edge incidence matrices of the graph.
+
+    Parameters:
+        G (nx.DiGraph):
+            Directed graph representing the quantum network.
+        topo (Topology):
+            Lookups of `G` from `build_topology`.
+
+    Returns:
+        tuple[sp.csr_matrix, sp.csr_matrix]: V x E int8 matrices `A_in` and `A_out`, where column e is 1 at the head
+        (respectively tail) of edge e.
+    """
+    # Coefficients are 0/+1/-1, so the matrices are kept as int8 (int32 indices) until Gurobi reads them
+    heads = np.array([topo.node_indices[v] for _, v in topo.edges], dtype=np.int32)
+    tails = np.array([topo.node_indices[u] for u, _ in topo.edges], dtype=np.int32)
+    edge_range = np.arange(len(topo.edges), dtype=np.int32)
+    ones = np.ones(len(edge_range), dtype=np.int8)
+    shape = (len(G.nodes()), len(topo.edges))
+    A_in = sp.csr_matrix((ones, (heads, edge_range)), shape=shape)
+    A_out = sp.csr_matrix((ones, (tails, edge_range)), shape=shape)
+    return A_in, A_out